@@ -1,20 +1,17 @@
+import os
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-import shapefile
-from shapely.ops import cascaded_union
-from shapely.geometry import Point, Polygon
-import shapefile as sf
+import shapely
+import shapely.errors
+import pyogrio
+import pyarrow as pa
+import pyarrow.compute as pc
+import joblib
+from shapely.geometry import Point
 
-
-def gen_polygons_from_shape(shape):
-    """Gera polígonos a partir das partes do shape.
-
-    Args:
-        shape (shapefile.Shape): shape a converter
-    """
-    offset_parts = list(shape.parts[1:]) + [len(shape.points)]
-    for part_start, part_end in zip(shape.parts, offset_parts):
-        yield Polygon(shape.points[part_start:part_end])
+# Ottobacias já carregadas, para não reler o shapefile a cada ponto
+_OTTOBACIAS = {}
 
 
 def is_within_bounds(point, bounding_box):
@@ -22,7 +19,7 @@ def is_within_bounds(point, bounding_box):
 
     Args:
         point (shapely.geometry.Point): ponto a verificar
-        bounding_box (list): lista de coordenadas (sf.Shape.bbox)
+        bounding_box (list): lista de coordenadas (minx, miny, maxx, maxy)
 
     Returns:
         bool: True se estiver dentro, Falso caso contrário
@@ -31,37 +28,261 @@ def is_within_bounds(point, bounding_box):
     return (x1 <= point.x <= x2) and (y1 <= point.y <= y2)
 
 
-def is_within_shape(point, shape):
-    """Verifica se o shape contém o ponto dado.
+def is_within_shape(point, ottobacias, idx):
+    """Verifica se a ottobacia contém o ponto dado.
 
     Args:
         point (shapely.geometry.Point): ponto a verificar
-        shape (sf.Shape): shape a verificar (pyshp)
+        ottobacias (dict): ottobacias carregadas (load_ottobacias)
+        idx (int): índice da ottobacia a verificar
 
     Returns:
         bool: True se o ponto está dentro, Falso caso contrário
     """
     # Verifica primeiro se o ponto está fora da bounding box (mais rápido!)
-    if not is_within_bounds(point, shape.bbox):
+    if not is_within_bounds(point, ottobacias['bounds'][idx]):
         return False
 
-    # Verifica então se alguma das partes do polígono contém o ponto
-    for poly in gen_polygons_from_shape(shape):
-        if point.within(poly):
-            return True
+    # Verifica então o polígono, já preparado na leitura
+    return shapely.contains_xy(ottobacias['geoms'][idx], point.x, point.y)
+
+
+def load_ottobacias(shapefile_path, reach_field, basin_field, area_field=None):
+    """Carrega o shapefile das ottobacias uma única vez.
+
+    Os registros são lidos em bloco pelo GDAL como uma tabela Arrow, apenas com
+    os campos necessários, sem montar um GeoDataFrame. As geometrias são
+    convertidas de uma só vez a partir do WKB. O índice espacial (STRtree), as
+    bounding boxes, os polígonos preparados (shapely.prepare) e os códigos de
+    curso d'água e de bacia (já convertidos para arrays NumPy) ficam guardados
+    em memória e são reaproveitados nas chamadas seguintes.
+
+    Os códigos de bacia são completados com zeros à direita até o tamanho do
+    maior código e convertidos para int64 (pyarrow.compute). Com todos no mesmo
+    tamanho, comparar os códigos truncados no tamanho da bacia inicial equivale
+    a comparar diretamente esses inteiros.
+
+    A área é convertida para float64; valores nulos ou que não são números
+    ficam NaN (com um aviso) e propagam para a soma das áreas da bacia.
+
+    Args:
+        shapefile_path (str): caminho do shapefile das ottobacias
+        reach_field (str): nome do campo do código do curso d'água
+        basin_field (str): nome do campo do código da bacia
+        area_field (str): nome do campo do valor da área (se disponível)
 
-    return False
+    Returns:
+        dict: 'reach' (numpy.ndarray de str), 'reach_sorted' (os mesmos
+            códigos em ordem crescente), 'reach_order' (índices das ottobacias
+            nessa ordem), 'basin' (numpy.ndarray de int64), 'area'
+            (numpy.ndarray de float64 com as áreas, None se area_field == None),
+            'geoms' (numpy.ndarray com os polígonos preparados), 'tree'
+            (shapely.STRtree) e 'bounds' (numpy.ndarray Nx4)
+    """
+    columns = [reach_field, basin_field] if area_field == None else [reach_field, basin_field, area_field]
+    key = (shapefile_path, tuple(columns))
+    if key not in _OTTOBACIAS:
+        meta, table = pyogrio.read_arrow(shapefile_path, columns=columns)
+
+        # Corrige as geometrias inválidas uma única vez, para não precisar de buffer(0) a cada união
+        geoms = shapely.from_wkb(table.column(meta['geometry_name'] or 'wkb_geometry').to_numpy())
+        geoms = shapely.make_valid(geoms)
+
+        # O make_valid pode gerar linhas, pontos ou GeometryCollection (partes ou
+        # anéis inteiros colapsados), então mantém apenas os polígonos dessas
+        # ottobacias, agrupados em um único MultiPolygon por registro (sem precisar
+        # de união). Sem nenhum polígono, o registro fica com um MultiPolygon vazio
+        for i in np.flatnonzero(~np.isin(shapely.get_type_id(geoms), (-1, 3, 6))):
+            parts = shapely.get_parts(geoms[i])
+            geoms[i] = shapely.multipolygons(shapely.get_parts(parts[np.isin(shapely.get_type_id(parts), (3, 6))]))
+
+        # Prepara os polígonos (índice das arestas) para os testes de ponto no polígono
+        shapely.prepare(geoms)
+
+        # Códigos do curso d'água ordenados: as ottobacias com o mesmo prefixo
+        # ficam em um intervalo contínuo, encontrado por busca binária
+        reach = table.column(reach_field).to_numpy().astype(str)
+        reach_order = np.argsort(reach, kind='stable')
+
+        basin_str = pc.cast(table.column(basin_field), pa.string())
+        basin_max_length = pc.max(pc.utf8_length(basin_str)).as_py()
+        basin = pc.cast(pc.utf8_rpad(basin_str, width=basin_max_length, padding='0'), pa.int64())
+
+        # Converte a área (que pode estar como texto, com vírgula decimal) uma única vez.
+        # Valores nulos ou inválidos ficam NaN, e são avisados
+        area = None
+        if area_field != None:
+            area = table.column(area_field)
+            if pa.types.is_string(area.type) or pa.types.is_large_string(area.type):
+                area = pc.replace_substring(area, ',', '.')
+            area = pd.to_numeric(pd.Series(area.to_numpy()), errors='coerce').to_numpy(dtype=np.float64)
+            n_invalid = np.count_nonzero(np.isnan(area))
+            if n_invalid:
+                print(f'Atenção: {n_invalid} ottobacias com área nula ou inválida ({area_field}), '
+                      f'a área das bacias que as contêm fica NaN')
+
+        _OTTOBACIAS[key] = {
+            'reach': reach,
+            'reach_sorted': reach[reach_order],
+            'reach_order': reach_order,
+            'basin': basin.to_numpy(),
+            'area': area,
+            'geoms': geoms,
+            'tree': shapely.STRtree(geoms),
+            'bounds': shapely.bounds(geoms),
+        }
+    return _OTTOBACIAS[key]
+
+
+def read_points(shapefile_path, bbox=None, cache_dir=None):
+    """Lê os pontos de outorga a partir de uma cópia em FlatGeobuf.
+
+    Na primeira execução (ou se algum arquivo do shapefile, .shp, .dbf, .shx,
+    .prj ou .cpg, for mais recente) os pontos são convertidos para FlatGeobuf,
+    que é ordenado espacialmente e tem um índice embutido. Assim é possível ler
+    apenas os pontos de uma região (bbox), com o filtro feito pelo GDAL, sem
+    carregar o arquivo inteiro. Como o FlatGeobuf não guarda a ordem original,
+    o número de cada registro no shapefile é gravado junto e os pontos são
+    devolvidos nessa ordem.
+
+    Atenção: o arquivo .fgb é gravado em disco, por padrão na mesma pasta do
+    shapefile (pode ser trocada com cache_dir). Se houver pontos sem geometria,
+    o .fgb é gravado sem o índice espacial, que não aceita geometrias nulas.
 
+    Args:
+        shapefile_path (str): caminho do shapefile dos pontos
+        bbox (tuple, optional): Defaults to None. (minx, miny, maxx, maxy) da região a ler
+        cache_dir (str, optional): Defaults to None. Pasta onde gravar o .fgb (None: pasta do shapefile)
 
-def gen_polygons_from_shape(shape):
-    """Gera polígonos a partir das partes do shape.
+    Returns:
+        geopandas.GeoDataFrame: pontos lidos, na ordem do shapefile
+    """
+    base_path = os.path.splitext(shapefile_path)[0]
+    fgb_path = base_path + '.fgb'
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        fgb_path = os.path.join(cache_dir, os.path.basename(fgb_path))
+    # Editar apenas os atributos reescreve só o .dbf, então compara com o mais recente
+    shp_mtime = max(os.path.getmtime(base_path + ext) for ext in ('.shp', '.dbf', '.shx', '.prj', '.cpg')
+                    if os.path.exists(base_path + ext))
+    if not os.path.exists(fgb_path) or os.path.getmtime(fgb_path) < shp_mtime:
+        points = pyogrio.read_dataframe(shapefile_path, use_arrow=True)
+        points['_ORDEM'] = np.arange(len(points))
+        # O índice espacial do FlatGeobuf não aceita geometrias nulas ou vazias
+        has_null = (points.geometry.isna() | points.geometry.is_empty).any()
+        pyogrio.write_dataframe(points, fgb_path, driver='FlatGeobuf', SPATIAL_INDEX='NO' if has_null else 'YES')
+
+    # A leitura via Arrow de um .fgb sem índice espacial e com geometrias nulas
+    # derruba o processo, então o cache é lido pelo caminho padrão do pyogrio
+    points = pyogrio.read_dataframe(fgb_path, bbox=bbox)
+    return points.sort_values(by='_ORDEM').drop(columns='_ORDEM').reset_index(drop=True)
+
+
+def find_start_basins(ottobacias, xs, ys):
+    """Encontra, de uma só vez, a ottobacia na qual cada ponto se encontra.
+
+    Todos os pontos são consultados no STRtree das ottobacias em uma única
+    chamada, e os candidatos da bounding box são verificados de uma vez nos
+    polígonos preparados. Caso mais de uma ottobacia contenha o ponto, fica com
+    a primeira do arquivo.
 
     Args:
-        shape (shapefile.Shape): shape a converter
+        ottobacias (dict): ottobacias carregadas (load_ottobacias)
+        xs (numpy.ndarray): coordenadas x dos pontos, no mesmo sistema do shapefile
+        ys (numpy.ndarray): coordenadas y dos pontos, no mesmo sistema do shapefile
+
+    Returns:
+        numpy.ndarray: índice da ottobacia de cada ponto, -1 se estiver fora
     """
-    offset_parts = list(shape.parts[1:]) + [len(shape.points)]
-    for part_start, part_end in zip(shape.parts, offset_parts):
-        yield Polygon(shape.points[part_start:part_end])
+    n_basins = len(ottobacias['geoms'])
+    pt_idx, basin_idx = ottobacias['tree'].query(shapely.points(xs, ys))
+    inside = shapely.contains_xy(ottobacias['geoms'][basin_idx], xs[pt_idx], ys[pt_idx])
+    pt_idx, basin_idx = pt_idx[inside], basin_idx[inside]
+
+    start_idx = np.full(len(xs), n_basins)
+    np.minimum.at(start_idx, pt_idx, basin_idx)
+    start_idx[start_idx == n_basins] = -1
+    return start_idx
+
+
+def trace_basin(ottobacias, idx):
+    """Gera o polígono completo da bacia a partir da ottobacia da exutória.
+
+    São unidas as ottobacias com mesmo curso d'água, nas quais o código da
+    bacia é maior do que o da ottobacia inicial.
+
+    Args:
+        ottobacias (dict): ottobacias carregadas (load_ottobacias)
+        idx (int): índice da ottobacia na qual se encontra a exutória
+
+    Returns:
+        shapely.geometry.Polygon: polígono da bacia
+        area: float com o valor da soma das areas das ottobacias (None se a área não foi carregada)
+        reach: str com o código do curso d'água da ottobacia inicial
+    """
+    # Salva informações sobre o curso d'água e bacia encontrados
+    selected_reach = str(ottobacias['reach'][idx])
+    selected_basin_int = ottobacias['basin'][idx]
+
+    # O código do curso d'água deve iniciar com o encontrado (busca binária nos
+    # códigos ordenados) e o código da bacia (todos completados com zeros no
+    # mesmo tamanho) deve ser maior ou igual que o da bacia encontrada
+    start, end = np.searchsorted(ottobacias['reach_sorted'], [selected_reach, selected_reach + '\uffff'])
+    candidates = ottobacias['reach_order'][start:end]
+    selected = candidates[ottobacias['basin'][candidates] >= selected_basin_int]
+
+    basin_polygons = ottobacias['geoms'][selected]
+    area = None
+    if ottobacias['area'] is not None:
+        area = ottobacias['area'][selected].sum()
+
+    # Retorna a união de todos os polígonos da bacia. As ottobacias formam uma
+    # cobertura (não se sobrepõem), então basta eliminar as arestas em comum.
+    # Caso existam sobreposições (resultado inválido) ou vizinhos sem os mesmos
+    # vértices na aresta em comum (erro do GEOS, por exemplo nós criados pelo
+    # make_valid em apenas um dos lados), refaz com a união completa (cascaded
+    # union do GEOS, dividindo para conquistar)
+    try:
+        basin = shapely.coverage_union_all(basin_polygons)
+    except shapely.errors.GEOSException:
+        basin = None
+    if basin is None or not shapely.is_valid(basin):
+        basin = shapely.union_all(basin_polygons)
+    return basin, area, selected_reach
+
+
+def trace_basins(ottobacias, start_idx):
+    """Traça as bacias de um conjunto de ottobacias iniciais.
+
+    Cada bacia é independente das demais, então a função é chamada em paralelo
+    (joblib) com uma parte das ottobacias iniciais em cada processo.
+
+    Args:
+        ottobacias (dict): ottobacias carregadas (não precisa do 'tree')
+        start_idx (numpy.ndarray): índices das ottobacias nas quais estão as exutórias
+
+    Returns:
+        list: tuplas (polígono, área, curso d'água) de cada bacia
+    """
+    return [trace_basin(ottobacias, idx) for idx in start_idx]
+
+
+def sum_within(polygons, points, values):
+    """Soma, para cada polígono, os valores dos pontos que o interceptam.
+
+    É construído um STRtree com os pontos e todos os polígonos são consultados
+    em uma única chamada, em vez de testar todos os pontos em cada polígono.
+
+    Args:
+        polygons (numpy.ndarray): polígonos (bacias)
+        points (numpy.ndarray): pontos (shapely.geometry.Point)
+        values (numpy.ndarray): valor de cada ponto, NaN é ignorado
+
+    Returns:
+        numpy.ndarray: soma dos valores dentro de cada polígono
+    """
+    poly_idx, pt_idx = shapely.STRtree(points).query(polygons, predicate='intersects')
+    return np.bincount(poly_idx, weights=np.nan_to_num(values[pt_idx]), minlength=len(polygons))
 
 
 def find_basin_adaptado(shapefile_path, reach_field, basin_field, x, y, area_field=None, progress_callback=None,
@@ -69,10 +290,10 @@ def find_basin_adaptado(shapefile_path, reach_field, basin_field, x, y, area_fie
     """Encontra a bacia dadas as coordenadas (x, y) da exutória.
 
     O algorítmo primeiramente procura a ottobacia na qual o ponto se encontra,
-    verificando se está dentro do polígono. Em seguida, é gerado o polígono
-    completo da bacia, buscando ottobacias com mesmo curso d'água (reach_field),
-    nas quais o código da bacia é maior do que a bacia encontrada inicialmente
-    (basin_field).
+    consultando o índice espacial das ottobacias (carregadas uma única vez).
+    Em seguida, é gerado o polígono completo da bacia, buscando ottobacias com
+    mesmo curso d'água (reach_field), nas quais o código da bacia é maior do
+    que a bacia encontrada inicialmente (basin_field).
 
     Pode ser passada uma função para reportar o progresso, a qual deve receber
     um número inteiro.
@@ -96,99 +317,60 @@ def find_basin_adaptado(shapefile_path, reach_field, basin_field, x, y, area_fie
     """
 
     point = Point(x, y)
-    current_progress = 0
     if progress_callback is None:
         progress_callback = lambda i: None
 
-    with sf.Reader(shapefile_path) as shp:
-        # Pega os campos do shape, excluindo o primeiro (é uma flag)
-        fields = [f[0] for f in shp.fields[1:]]
-        feature_count = len(shp)
-
-        # Verifica os polígonos até encontrar a bacia
-        for i, sr in enumerate(shp.iterShapeRecords()):
-            if is_within_shape(point, sr.shape):
-                break
-
-            progress = ((i + 1) * 50) // feature_count
-            if current_progress < progress:
-                current_progress += 1
-                progress_callback(current_progress)
+    ottobacias = load_ottobacias(shapefile_path, reach_field, basin_field, area_field)
 
+    # Consulta o índice espacial e verifica apenas os candidatos da bounding box.
+    # Caso mais de uma ottobacia contenha o ponto, fica com a primeira do arquivo
+    for i in sorted(ottobacias['tree'].query(point)):
+        if is_within_shape(point, ottobacias, i):
+            break
+    else:
+        # O loop não foi parado, então não foi encontrada nenhuma bacia
+        progress_callback(100)
+        if area_field != None and return_reach:
+            return None, None, None
+        elif area_field != None:
+            return None, None
         else:
-            # O loop não foi parado, então não foi encontrada nenhuma bacia
-            progress_callback(100)
-            if area_field != None:
-                return None, None
-            else:
-                return None
+            return None
+    progress_callback(50)
+
+    poly, area, reach = trace_basin(ottobacias, i)
+    progress_callback(100)
 
-    # Salva informações sobre o curso d'água e bacia encontrados
-    reach_index = fields.index(reach_field)
-    basin_index = fields.index(basin_field)
-    if area_field != None:
-        area_index = fields.index(area_field)
-        selected_area = sr.record[area_index]
-    selected_reach = sr.record[reach_index]
-    selected_basin = sr.record[basin_index]
-    selected_basin_int = int(selected_basin)
-    selected_basin_length = len(selected_basin)
-
-    # Abre novamente o shapefile para encontrar a bacia completa
-    basin_polygons = [];
-    area = 0.0
-    with sf.Reader(shapefile_path) as shp:
-        for i, sr in enumerate(shp.iterShapeRecords()):
-            # O código do curso d'água deve iniciar com o encontrado
-            reach = sr.record[reach_index]
-            if reach.startswith(selected_reach):
-                # Deixa o código da bacia no mesmo tamanho para poder comparar
-                basin = sr.record[basin_index][:selected_basin_length].ljust(selected_basin_length, '0')
-                basin_int = int(basin)
-
-                # O código da bacia deve ser maior ou igual que o da bacia encontrada
-                if basin_int >= selected_basin_int:
-                    for poly in gen_polygons_from_shape(sr.shape):
-                        basin_polygons.append(poly.buffer(0))
-                        if area_field != None:
-                            try:
-                                area += float(sr.record[area_index].replace(',', '.'))
-                            except AttributeError:
-                                area += sr.record[area_index]
-
-            progress = 50 + ((i + 1) * 50) // feature_count
-            if current_progress < progress:
-                current_progress += 1
-                progress_callback(current_progress)
-
-    # Retorna a união de todos os polígonos da bacia
     if area_field != None and return_reach:
-        return cascaded_union(basin_polygons), area, selected_reach
+        return poly, area, reach
     elif area_field != None:
-        return cascaded_union(basin_polygons), area
+        return poly, area
     else:
-        return cascaded_union(basin_polygons)
+        return poly
+
 
+def save_polygons(path, polygons, crs=None):
+    """Salva polígonos em um FlatGeobuf, gravados de uma só vez pelo GDAL
 
-def save_polygons(shapefile_path, *polygons):
-    """Salva polígonos em um shp
+    O FlatGeobuf é ordenado espacialmente e tem um índice (R-tree de Hilbert)
+    embutido, então leituras posteriores com filtro por bbox são rápidas.
 
     Args:
-        shapefile_path (str): caminho do shapefile
-        polygons (shapely.geometry.Polygon): polígonos a salvar
+        path (str): caminho do arquivo (.fgb)
+        polygons (list): polígonos a salvar (shapely.geometry.Polygon)
+        crs (optional): Defaults to None. Sistema de coordenadas dos polígonos
     """
-    if polygons:
-        with shapefile.Writer(shapefile_path) as shp:
-            shp.field('id', 'N')
-            for i, poly in enumerate(polygons):
-                shp.record(i)
-                shp.poly([poly.exterior.coords])
+    if len(polygons):
+        gdf = gpd.GeoDataFrame({'id': range(len(polygons))}, geometry=list(polygons), crs=crs)
+        pyogrio.write_dataframe(gdf, path, driver='FlatGeobuf')
 
 
 # Arquivo para salvar os dados
 COBACIAS = '/media/joao/HD-jao/bacia_iguacu_Camila/teste_3/shps/OTTOBACIAS.shp'
 SHP_QMAX = '/media/joao/HD-jao/bacia_iguacu_Camila/teste_2/shps/H_Integrada_AEG_Enquadramento.shp'
 Dir_save = '/media/joao/HD-jao/bacia_iguacu_Camila/teste_3/resultados/'
+# Pasta para as cópias em FlatGeobuf dos pontos (None: junto dos shapefiles)
+Dir_cache = None
 # converte de m3/h pra l/s
 F_CONVERCAO = 3.6
 
@@ -205,7 +387,7 @@ name_vazoes = 'VAZAO_OUTO'
 # name_vazoes = 'EFLO_OT_E1'
 
 # Dataframe com os pontos a serem coletados - TROCAR DEPOIS
-dt = gpd.read_file(POINTS_SHP)
+dt = read_points(POINTS_SHP, cache_dir=Dir_cache)
 dt = dt[['OBJECTID', 'geometry', 'COD_OTTO', name_vazoes]]
 dt[name_vazoes] = dt[name_vazoes] / F_CONVERCAO
 
@@ -213,42 +395,63 @@ dt_Qmax = gpd.read_file(SHP_QMAX)
 dt_Qmax.index = dt_Qmax['cobacia']
 dt_Qmax = dt_Qmax[['areamont_Q']]
 
-dt_subbacias = pd.DataFrame()
-dt_subbacias['Longitude'] = dt['geometry'].x
-dt_subbacias['Latitude'] = dt['geometry'].y
-dt_subbacias['COCURSODAG'] = 'Erro'
-dt_subbacias['Q_Outorga (l/s)'] = 'Erro'
-dt_subbacias['Q95 (l/s)'] = 'Erro'
-dt_subbacias['Poli'] = 'Erro'
-
+# Coordenadas e vazões dos pontos
+xs = dt['geometry'].x.to_numpy()
+ys = dt['geometry'].y.to_numpy()
+vazoes = dt[name_vazoes].to_numpy()
+
+# Ottobacia na qual cada ponto se encontra, consultando todos os pontos de uma vez
+ottobacias = load_ottobacias(COBACIAS, 'cocursodag', 'cobacia', 'nuareacont')
+start_idx = find_start_basins(ottobacias, xs, ys)
+
+# Traça as bacias de drenagem em paralelo, dividindo as ottobacias iniciais entre
+# os processos. Pontos na mesma ottobacia têm a mesma bacia, então cada ottobacia
+# é traçada uma única vez. As ottobacias são enviadas uma vez por processo, sem o
+# STRtree (usado apenas no processo principal)
+shared = {k: v for k, v in ottobacias.items() if k != 'tree'}
+unique_idx = np.unique(start_idx[start_idx != -1])
+n_jobs = joblib.cpu_count()
+print(f'Pontos Executados: {np.count_nonzero(start_idx != -1)} de {len(dt)}, '
+      f'em {len(unique_idx)} ottobacias ({n_jobs} processos)')
+results = joblib.Parallel(n_jobs=n_jobs, backend='loky', verbose=10)(
+    joblib.delayed(trace_basins)(shared, chunk)
+    for chunk in np.array_split(unique_idx, n_jobs)
+)
+results = [r for chunk_results in results for r in chunk_results]
+
+# Soma as vazões dos pontos dentro de cada bacia
+polys = np.array([poly for poly, area, reach in results], dtype=object)
+vazoes_outo = sum_within(polys, dt['geometry'].values, vazoes)
+basins = {idx: (*r, vazao_outo) for idx, r, vazao_outo in zip(unique_idx, results, vazoes_outo)}
+
+# Resultados de cada ponto, o GeoDataFrame é montado uma única vez no final
+rows = []
 for i, (p, COBA_REF) in enumerate(dt[['geometry', 'COD_OTTO']].values):
-
-    print(f'Pontos Executados: {i + 1} de {len(dt_subbacias.values)}')
-    # Traça a bacia de drenagem
-    poly, area, reach = find_basin_adaptado(COBACIAS, 'cocursodag', 'cobacia', p.x, p.y, area_field='nuareacont',
-                                            return_reach=True)
-
-    if poly != None:
-        # Pega o CÓDIGO pontos dentro do poligono
-        ids = dt['OBJECTID'][dt['geometry'].intersects(poly.buffer(0))].tolist()
-
-        vazao_outo = dt[name_vazoes][dt['OBJECTID'].isin(ids)].sum()
+    if start_idx[i] != -1:
+        poly, area, reach, vazao_outo = basins[start_idx[i]]
         Q_max = dt_Qmax.loc[str(COBA_REF)].values[0]
 
-        dt_subbacias['Q_Outorga (l/s)'].loc[i] = round(vazao_outo, 2)
-        dt_subbacias['Q95 (l/s)'].loc[i] = round(Q_max, 2)
-        dt_subbacias['COCURSODAG'].loc[i] = reach
-        dt_subbacias['Poli'].loc[i] = poly
+        rows.append({
+            'Longitude': p.x,
+            'Latitude': p.y,
+            'COCURSODAG': reach,
+            'Q_Outorga (l/s)': round(vazao_outo, 2),
+            'Q95 (l/s)': round(Q_max, 2),
+            'Poli': poly,
+        })
 
-        # save_polygons(f'{Dir_save_pol}/Shape_P_{i}', poly)
+        # save_polygons(f'{Dir_save_pol}/Shape_P_{i}.fgb', [poly], crs=dt.crs)
     else:
         # Caso o ponto fique fora dos poligonos
         with open(f'{Dir_save_pol}Shape_Ponto_{i}_ERRO.txt', "w") as text_file:
             text_file.write("Ponto está fora do shape de bacias")
 
-dt_subbacias = dt_subbacias[dt_subbacias != 'Erro'].dropna()
+# Colunas explícitas para gerar o arquivo mesmo sem nenhum ponto dentro das ottobacias
+columns = ['Longitude', 'Latitude', 'COCURSODAG', 'Q_Outorga (l/s)', 'Q95 (l/s)', 'Poli']
+dt_subbacias = gpd.GeoDataFrame(rows, columns=columns, geometry='Poli', crs=dt.crs).dropna()
+# Ou todas as bacias em um único arquivo
+# save_polygons(f'{Dir_save_pol}/Shape_P.fgb', dt_subbacias['Poli'].values, crs=dt.crs)
 dt_subbacias['Q_Max (l/s)'] = dt_subbacias['Q95 (l/s)'] / 2
 dt_subbacias['Fator de Capacidade'] = dt_subbacias['Q_Outorga (l/s)'] / dt_subbacias['Q_Max (l/s)']
 
-dt_subbacias = gpd.GeoDataFrame(dt_subbacias, geometry='Poli')
 dt_subbacias.to_file(f'{Dir_save}{f_saida}.shp', driver='ESRI Shapefile')